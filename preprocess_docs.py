@@ -3,47 +3,523 @@ This module provides functionality for loading documents, setting up embeddings,
 vector data in a vector store using Qdrant and Jina models. It contains three primary functions:
 - `load_docs`: Loads documents from a given file using the UnstructuredLoader, designed to handle
   high-resolution document processing.
+- `coalesce`: Merges contiguous small segments of the same page into larger chunks before
+  embedding.
+- `FastJinaEmbeddings`: Jina embeddings client reusing pooled HTTP/2 connections and sending
+  length-sorted batches.
+- `build_segment_soa`: Groups the segment coordinates of each page into NumPy arrays for plotting.
+- `get_embeddings`: Builds the embeddings model, either the Jina API or a local Infinity server
+  serving the same model.
 - `set_embeddings`: Initializes a Jina embeddings model and a Qdrant vector store for embedding and
   managing vector data, creating a collection and generating unique document IDs.
-- `add_doc`: Adds the processed documents to the vector store while handling various exceptions
-  such as connection or type errors.
+- `similarity_search`: Queries the vector store, caching query embeddings and reusing the results
+  of near-duplicate queries.
+- `add_doc`: Adds the processed documents to the vector store in concurrent batches while handling
+  various exceptions such as connection or type errors.
 
-The module utilizes environment variables for API keys and in-memory vector storage for managing
-the vectorized representations of document content.
+The module utilizes environment variables for API keys and a persistent Qdrant storage, either a
+local on-disk collection or a Qdrant server, for managing the vectorized representations of
+document content, so that documents embedded in a previous run are not embedded again.
 """
 import os
-from uuid import uuid4
+import asyncio
+import hashlib
+import pickle
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from typing import ClassVar
+from uuid import UUID
+import fitz
+import httpx
+import numpy as np
+import orjson
 from loguru import logger
 from langchain_unstructured import UnstructuredLoader
-from langchain_community.embeddings import JinaEmbeddings
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_community.embeddings import InfinityEmbeddings, JinaEmbeddings
 from langchain_qdrant import QdrantVectorStore
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import Distance, VectorParams
+from qdrant_client.http.models import (
+    BinaryQuantization,
+    BinaryQuantizationConfig,
+    Distance,
+    HnswConfigDiff,
+    PointStruct,
+    QuantizationSearchParams,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+    VectorParams,
+)
+from utils import cosine_topk, segments_to_soa
 
+EMBEDDINGS_BACKEND = os.environ.get("RAG_EMBEDDINGS_BACKEND", "jina")
+INFINITY_API_URL = os.environ.get("RAG_INFINITY_URL", "http://localhost:7997")
+QDRANT_HOST = os.environ.get("QDRANT_HOST")
+QDRANT_GRPC_PORT = int(os.environ.get("QDRANT_GRPC_PORT", "6334"))
+QDRANT_PATH = os.environ.get("QDRANT_PATH", "qdrant_data")
+QUANTIZATION = os.environ.get("RAG_QUANTIZATION", "int8")
+DOCS_CACHE_DIR = os.path.join(".cache", "docs")
+BATCH_SIZE = 64
+MAX_CONCURRENT_BATCHES = 5
+JINA_API_URL = "https://api.jina.ai/v1/embeddings"
+SEARCH_PARAMS = SearchParams(hnsw_ef=128, quantization=QuantizationSearchParams(rescore=True))
+SEMANTIC_CACHE_SIZE = 256
+SEMANTIC_CACHE_THRESHOLD = 0.86
 
-def load_docs(file_path: str):
+# collection name -> search parameters matching the collection's quantization
+_search_params = {}
+# collection name -> {"vectors": recent normalized query vectors, "results": [(k, documents)]}
+_semantic_cache = {}
+
+
+def _load_page(file_path: str, page_index: int):
+    """
+    Partition a single PDF page locally with the hi-res strategy.
+
+    Args:
+        file_path (str): The file path of the PDF document.
+        page_index (int): The page to partition (0-based index).
+
+    Returns:
+        list: The document objects extracted from the page, stamped with their 1-based page number
+        and the file metadata of the original document.
+    """
+    with fitz.open(file_path) as pdf, tempfile.TemporaryDirectory() as tmp_dir:
+        pdf.select([page_index])
+        page_path = os.path.join(tmp_dir, f"page_{page_index + 1}.pdf")
+        pdf.save(page_path)
+        page_doc = UnstructuredLoader(page_path, strategy="hi_res", coordinates=True).load()
+
+    # the loader describes the temporary single-page PDF; point the metadata back at the original
+    last_modified = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime("%Y-%m-%dT%H:%M:%S")
+    for d in page_doc:
+        d.metadata["page_number"] = page_index + 1
+        d.metadata["source"] = file_path
+        d.metadata["filename"] = os.path.basename(file_path)
+        d.metadata["file_directory"] = os.path.dirname(file_path)
+        d.metadata["last_modified"] = last_modified
+    return page_doc
+
+
+def load_docs(file_path: str, partition_via_api: bool = True, max_workers: int | None = None):
     """
     Load documents from a file using the UnstructuredLoader.
 
     Args:
         file_path (str): The file path to load the documents from.
+        partition_via_api (bool, optional): Whether to partition the file with the Unstructured API.
+            Defaults to True.
+        max_workers (int, optional): Number of worker processes used for local partitioning.
+            Defaults to the number of CPUs.
 
     Returns:
         list: A list of loaded document objects containing content and metadata.
 
     This function uses the `UnstructuredLoader` to load the documents from the specified file path.
-    The loader is configured with a high-resolution strategy, partitioning via API, and includes
-    coordinates.
+    The loader is configured with a high-resolution strategy and includes coordinates. When the
+    file is partitioned locally, each page is processed in its own worker process and the results
+    are concatenated in page order.
+
+    Every document is stamped with the SHA-256 of the file contents as `metadata["file_hash"]`.
+    Loaded documents are cached on disk, keyed by that hash, so repeated runs on the same file skip
+    partitioning. Set the `RAG_DISABLE_CACHE` environment variable to bypass the cache.
     """
-    loader = UnstructuredLoader(
-        file_path, strategy="hi_res", partition_via_api=True, coordinates=True
-    )
-    doc = loader.load()
+    with open(file_path, "rb") as f:
+        file_hash = hashlib.sha256(f.read()).hexdigest()
+
+    use_cache = not os.environ.get("RAG_DISABLE_CACHE")
+    if use_cache:
+        suffix = "api" if partition_via_api else "local"
+        cache_path = os.path.join(DOCS_CACHE_DIR, f"{file_hash}_{suffix}.pkl")
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, "rb") as f:
+                    doc = pickle.load(f)
+                for d in doc:
+                    d.metadata["file_hash"] = file_hash
+                logger.success(f"Document {file_path} loaded from cache.")
+                return doc
+            except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+                logger.warning(f"Ignoring unreadable cache {cache_path}: {e}")
+
+    if partition_via_api:
+        loader = UnstructuredLoader(
+            file_path, strategy="hi_res", partition_via_api=True, coordinates=True
+        )
+        doc = loader.load()
+    else:
+        with fitz.open(file_path) as pdf:
+            page_count = pdf.page_count
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+            pages = executor.map(_load_page, [file_path] * page_count, range(page_count))
+            doc = [d for page_doc in pages for d in page_doc]
+    for d in doc:
+        d.metadata["file_hash"] = file_hash
     logger.success(f"Document {file_path}sucessfully loaded.")
 
+    if use_cache:
+        os.makedirs(DOCS_CACHE_DIR, exist_ok=True)
+        # write to a temporary file first so an interrupted run never leaves a truncated cache
+        with tempfile.NamedTemporaryFile("wb", dir=DOCS_CACHE_DIR, suffix=".tmp", delete=False) as f:
+            try:
+                pickle.dump(doc, f)
+            except Exception:
+                f.close()
+                os.unlink(f.name)
+                raise
+        os.replace(f.name, cache_path)
+
     return doc
 
 
+def _merge_segments(segments):
+    """
+    Merge a run of same-page segments into a single document.
+
+    Args:
+        segments (list): Document objects from the same page, in reading order.
+
+    Returns:
+        Document: A document whose content joins the segments' contents and whose coordinates
+        span the bounding box of all the segments. Only the metadata shared by every segment (page,
+        file, ...) is kept; per-element fields such as `element_id` and `text_as_html` are dropped
+        and the category becomes "CompositeElement".
+    """
+    if len(segments) == 1:
+        return segments[0]
+
+    metadata = {
+        key: value
+        for key, value in segments[0].metadata.items()
+        if key not in ("element_id", "text_as_html")
+        and all(d.metadata.get(key) == value for d in segments[1:])
+    }
+    metadata["category"] = "CompositeElement"
+    coordinates = [d.metadata["coordinates"] for d in segments if d.metadata.get("coordinates")]
+    if coordinates:
+        points = np.array([p for c in coordinates for p in c["points"]], dtype=np.float32)
+        (x_min, y_min), (x_max, y_max) = points.min(axis=0), points.max(axis=0)
+        metadata["coordinates"] = {
+            **coordinates[0],
+            "points": (
+                (float(x_min), float(y_min)),
+                (float(x_min), float(y_max)),
+                (float(x_max), float(y_max)),
+                (float(x_max), float(y_min)),
+            ),
+        }
+    return Document(
+        page_content="\n\n".join(d.page_content for d in segments), metadata=metadata
+    )
+
+
+def coalesce(doc, max_chars: int = 2000, min_chars: int = 200):
+    """
+    Merge contiguous small segments of the same page into larger chunks.
+
+    Args:
+        doc (list): A list of document objects, as returned by `load_docs`.
+        max_chars (int, optional): Maximum number of characters of a merged chunk. Defaults to 2000.
+        min_chars (int, optional): Chunks shorter than this always absorb the next segment of the
+            same page, even past `max_chars`. Defaults to 200.
+
+    Returns:
+        list: The coalesced list of document objects.
+
+    Unstructured returns many tiny segments (headers, single lines) per page, each of which would
+    otherwise be embedded on its own. Segments are accumulated until adding the next one would
+    exceed `max_chars`, or until the page changes, so that short headers stay attached to the text
+    that follows them.
+    """
+    coalesced = []
+    current, current_len, current_page = [], 0, None
+    for d in doc:
+        page = d.metadata.get("page_number")
+        size = len(d.page_content)
+        fits = current_len + size <= max_chars or current_len < min_chars
+        if current and (page != current_page or not fits):
+            coalesced.append(_merge_segments(current))
+            current, current_len = [], 0
+        current.append(d)
+        current_len += size
+        current_page = page
+    if current:
+        coalesced.append(_merge_segments(current))
+
+    logger.info(f"Coalesced {len(doc)} segments into {len(coalesced)} chunks.")
+    return coalesced
+
+
+def build_segment_soa(doc):
+    """
+    Group the segment coordinates of each page into a structure of arrays.
+
+    Args:
+        doc (list): A list of document objects loaded with coordinates.
+
+    Returns:
+        dict: A dictionary mapping each page number to the output of `utils.segments_to_soa` for
+        the segments of that page, which can be passed directly to `utils.plot_pdf_with_boxes`.
+    """
+    pages = {}
+    for d in doc:
+        if d.metadata.get("coordinates"):
+            pages.setdefault(d.metadata.get("page_number", 0), []).append(d.metadata)
+    return {page: segments_to_soa(segments) for page, segments in pages.items()}
+
+
+class NormalizedEmbeddings(Embeddings):
+    """
+    Embeddings adapter that L2-normalizes the vectors returned by the wrapped model.
+
+    Normalizing once at embedding time lets the vector store rank by a plain dot product instead
+    of computing cosine similarity on every comparison.
+    """
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+
+    @staticmethod
+    def _normalize(vectors):
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return (matrix / np.where(norms == 0, 1.0, norms)).tolist()
+
+    def embed_documents(self, texts):
+        return self._normalize(self.embeddings.embed_documents(texts))
+
+    def embed_query(self, text):
+        return self._normalize(self.embeddings.embed_query(text))
+
+    async def aembed_documents(self, texts):
+        return self._normalize(await self.embeddings.aembed_documents(texts))
+
+    async def aembed_query(self, text):
+        return self._normalize(await self.embeddings.aembed_query(text))
+
+
+class FastJinaEmbeddings(JinaEmbeddings):
+    """
+    Jina embeddings client that reuses pooled HTTP/2 connections and serializes with `orjson`.
+
+    Texts are sorted by length and sent in batches of `BATCH_SIZE`, so each request carries texts
+    of similar size, and the embeddings are returned in the original order. The HTTP client is
+    shared by every instance and thread, which avoids a TCP and TLS handshake per request.
+    """
+
+    _client: ClassVar[httpx.Client | None] = None
+    _client_lock: ClassVar[threading.Lock] = threading.Lock()
+    _limits: ClassVar[httpx.Limits] = httpx.Limits(max_connections=32, keepalive_expiry=60)
+    # a full batch of long texts can take well over httpx's default 5 s to embed
+    _timeout: ClassVar[httpx.Timeout] = httpx.Timeout(60.0, connect=10.0)
+
+    def _headers(self):
+        return {
+            "Authorization": f"Bearer {self.jina_api_key.get_secret_value()}",
+            "Accept-Encoding": "identity",
+            "Content-Type": "application/json",
+        }
+
+    def _payload(self, texts):
+        return orjson.dumps({"input": texts, "model": self.model_name})
+
+    @staticmethod
+    def _parse(response):
+        response.raise_for_status()
+        data = orjson.loads(response.content)["data"]
+        return [item["embedding"] for item in sorted(data, key=lambda item: item["index"])]
+
+    @staticmethod
+    def _batches(texts):
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        return [order[i : i + BATCH_SIZE] for i in range(0, len(order), BATCH_SIZE)]
+
+    @classmethod
+    def _get_client(cls):
+        # add_doc embeds from several executor threads at once
+        with cls._client_lock:
+            if cls._client is None:
+                cls._client = httpx.Client(http2=True, limits=cls._limits, timeout=cls._timeout)
+        return cls._client
+
+    def embed_documents(self, texts):
+        client = self._get_client()
+        embeddings = [None] * len(texts)
+        for batch in self._batches(texts):
+            response = client.post(
+                JINA_API_URL,
+                content=self._payload([texts[i] for i in batch]),
+                headers=self._headers(),
+            )
+            for i, embedding in zip(batch, self._parse(response)):
+                embeddings[i] = embedding
+        return embeddings
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+@lru_cache(maxsize=None)
+def get_embeddings(backend: str = EMBEDDINGS_BACKEND):
+    """
+    Build the embeddings model once and share it between ingestion and querying.
+
+    Args:
+        backend (str, optional): Either "jina", to embed through the Jina API, or "infinity", to
+            embed with the same model served by a running Infinity server at `INFINITY_API_URL`.
+            Defaults to the `RAG_EMBEDDINGS_BACKEND` environment variable, or "jina" when it is
+            not set.
+
+    Returns:
+        NormalizedEmbeddings: The embeddings model, wrapped so that it returns unit-length vectors.
+        Both backends produce 768-dimensional vectors.
+    """
+    if backend == "jina":
+        embeddings = FastJinaEmbeddings(
+            jina_api_key=os.environ["JINA_API_KEY"], model_name="jina-embeddings-v2-base-en"
+        )
+    elif backend == "infinity":
+        # the server keeps the model loaded and batches requests across calls, and unlike the
+        # in-process engine it serves both the sync and async embedding methods
+        embeddings = InfinityEmbeddings(
+            model="jinaai/jina-embeddings-v2-base-en", infinity_api_url=INFINITY_API_URL
+        )
+    else:
+        raise ValueError(f"Unknown embeddings backend: {backend}")
+
+    return NormalizedEmbeddings(embeddings)
+
+
+@lru_cache(maxsize=1024)
+def _embed_query(query: str):
+    """
+    Embed a query, memoizing the result so repeated queries skip the embedding API call.
+
+    Args:
+        query (str): The query text.
+
+    Returns:
+        tuple: The query embedding.
+    """
+    return tuple(get_embeddings().embed_query(query))
+
+
+def _document_id(document):
+    """
+    Derive a stable UUID from a document's source file, page number and content.
+
+    The source file is identified by `metadata["file_hash"]`, as stamped by `load_docs`, so the
+    same file yields the same IDs whatever path it was loaded from. Documents without it fall back
+    to the absolute path of their source.
+
+    Args:
+        document: A document object with attributes 'page_content' and 'metadata'.
+
+    Returns:
+        str: The UUID built from the 128-bit BLAKE2b digest of the document.
+    """
+    metadata = document.metadata
+    source = metadata.get("file_hash") or os.path.abspath(
+        metadata.get("source") or metadata.get("filename", "")
+    )
+    key = f"{source}:{metadata.get('page_number', 0)}:{document.page_content}".encode("utf-8")
+    return str(UUID(bytes=hashlib.blake2b(key, digest_size=16).digest()))
+
+
+@lru_cache(maxsize=None)
+def _get_client(host: str | None, path: str):
+    """
+    Connect to Qdrant once per server or storage folder and share the client within the process.
+
+    Args:
+        host (str, optional): Host of a Qdrant server, reached over gRPC on `QDRANT_GRPC_PORT`.
+        path (str): Folder of the local on-disk storage, used when `host` is not set.
+
+    Returns:
+        QdrantClient: The Qdrant client.
+
+    Local mode takes an exclusive lock on its storage folder, so it can only be used by a single
+    process, and opening a second client on the same folder fails; only server mode supports
+    several processes sharing the collection. Local mode also searches by brute force and ignores
+    the HNSW index, quantization and search parameters, which only take effect on a server.
+    """
+    if host:
+        return QdrantClient(host=host, grpc_port=QDRANT_GRPC_PORT, prefer_grpc=True)
+    logger.info(
+        "Using Qdrant local mode: HNSW and quantization settings only apply with QDRANT_HOST."
+    )
+    return QdrantClient(path=path)
+
+
+def _quantization_config():
+    """
+    Build the Qdrant quantization config selected by `RAG_QUANTIZATION`.
+
+    Returns:
+        ScalarQuantization | BinaryQuantization: int8 scalar quantization ("int8", the default) or
+        1-bit binary quantization ("binary"), both kept in RAM.
+    """
+    if QUANTIZATION == "int8":
+        return ScalarQuantization(
+            scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+        )
+    if QUANTIZATION == "binary":
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+    raise ValueError(f"Unknown quantization: {QUANTIZATION}")
+
+
+def _check_collection_config(client, collection_name):
+    """
+    Warn when an existing collection was created with different settings than requested.
+
+    Args:
+        client (QdrantClient): The Qdrant client.
+        collection_name (str): Name of the existing collection.
+
+    Returns:
+        ScalarQuantization | BinaryQuantization | None: The quantization config of the collection.
+    """
+    config = client.get_collection(collection_name).config
+    vectors = config.params.vectors
+    if isinstance(vectors, VectorParams) and vectors.distance != Distance.DOT:
+        logger.warning(
+            f"Collection {collection_name} uses {vectors.distance} distance, but embeddings are "
+            "normalized for DOT; recreate the collection to use it."
+        )
+    # local mode does not keep quantization settings, so there is nothing to compare
+    expected = _quantization_config()
+    if QDRANT_HOST and type(config.quantization_config) is not type(expected):
+        logger.warning(
+            f"Collection {collection_name} was created with {config.quantization_config}, "
+            f"not the {QUANTIZATION} quantization set by RAG_QUANTIZATION; keeping the existing one."
+        )
+    return config.quantization_config
+
+
+def _collection_search_params(quantization_config):
+    """
+    Build the search parameters matching a collection's quantization.
+
+    Args:
+        quantization_config: The quantization config of the collection, if any.
+
+    Returns:
+        SearchParams: The search parameters.
+    """
+    if isinstance(quantization_config, BinaryQuantization):
+        # binary codes lose more precision, so more candidates are rescored with the original vectors
+        return SearchParams(
+            hnsw_ef=128, quantization=QuantizationSearchParams(rescore=True, oversampling=2.0)
+        )
+    return SEARCH_PARAMS
+
+
 def set_embeddings(doc, collection_name):
     """
     Set up embeddings, vector store, and client for managing and storing vector data.
@@ -52,60 +528,211 @@ def set_embeddings(doc, collection_name):
         doc (list): A list of Document objects to be embedded.
         collection_name (str): Name of the collection for storing vectors.
 
-    The function initializes the Jina embeddings model using the API key from environment variables.
-    It creates an in-memory Qdrant client, sets up a collection for storing vectors, and initializes
-    a QdrantVectorStore instance. UUIDs are generated for each document in the provided list.
+    The function initializes the embeddings model selected by `RAG_EMBEDDINGS_BACKEND`.
+    Embeddings are L2-normalized, so the collection ranks vectors by dot product.
+    It connects to the Qdrant server at `QDRANT_HOST` over gRPC when it is set, or to a local
+    on-disk storage at `QDRANT_PATH` otherwise (usable by a single process only), reusing the same
+    client across calls. The collection, with an explicit HNSW index and
+    int8 scalar or binary quantization (see `RAG_QUANTIZATION`), is created only if it does not
+    exist yet; an existing collection is reused as is, with a warning if its settings differ. The
+    index and quantization only take effect in server mode. A QdrantVectorStore instance is then
+    initialized on top of the collection. UUIDs are derived from
+    the source file contents, page number and content of each document in the provided list, so
+    re-ingesting the same document overwrites its points instead of duplicating them.
 
     Returns:
         tuple: A tuple containing the vector store and the generated UUIDs for the documents.
     """
-    logger.info("Setting Jina Model.")
-    embeddings = JinaEmbeddings(
-        jina_api_key=os.environ["JINA_API_KEY"], model_name="jina-embeddings-v2-base-en"
-    )
+    logger.info(f"Setting {EMBEDDINGS_BACKEND} embeddings model.")
+    embeddings = get_embeddings()
 
-    logger.info("Creating collection and setting Client.")
-    client = QdrantClient(":memory:")
-    client.create_collection(
-        collection_name=collection_name,
-        vectors_config=VectorParams(size=768, distance=Distance.COSINE),
-    )
+    logger.info("Setting Client.")
+    client = _get_client(QDRANT_HOST, QDRANT_PATH)
+
+    if client.collection_exists(collection_name):
+        logger.info(f"Reusing existing collection {collection_name}.")
+        quantization_config = _check_collection_config(client, collection_name)
+    else:
+        logger.info(f"Creating collection {collection_name}.")
+        quantization_config = _quantization_config()
+        client.create_collection(
+            collection_name=collection_name,
+            vectors_config=VectorParams(size=768, distance=Distance.DOT, on_disk=False),
+            hnsw_config=HnswConfigDiff(m=32, ef_construct=200),
+            quantization_config=quantization_config,
+        )
+    _search_params[collection_name] = _collection_search_params(quantization_config)
 
     logger.info("Setting Vector Store object.")
     vector_store = QdrantVectorStore(
         client=client,
         collection_name=collection_name,
         embedding=embeddings,
+        distance=Distance.DOT,
     )
 
     logger.info("Generating ids for the document content.")
-    uuids = [str(uuid4()) for _ in range(len(doc))]
+    uuids = [_document_id(d) for d in doc]
     logger.success("Qdrant Embedding Environment set!")
 
     return vector_store, uuids
 
 
-def add_doc(vector_store, doc, ids):
+def similarity_search(vector_store, query: str, k: int = 3):
+    """
+    Retrieve the `k` documents most similar to `query`.
+
+    The query embedding is memoized, and the results of previous queries are kept in a small
+    semantic cache: when a new query has a cosine similarity of at least `SEMANTIC_CACHE_THRESHOLD`
+    with a cached one, its results are returned without querying the vector store. The cache is
+    kept per collection and cleared by `add_doc` whenever the collection changes.
+
+    Args:
+        vector_store: An instance of QdrantVectorStore or similar that supports searching by vector.
+        query (str): The query text.
+        k (int, optional): Number of documents to retrieve. Defaults to 3.
+
+    Returns:
+        list: The retrieved document objects.
+    """
+    embedding = _embed_query(query)
+    vector = np.asarray(embedding, dtype=np.float32)
+
+    cache = _semantic_cache.setdefault(
+        vector_store.collection_name,
+        {"vectors": np.empty((0, len(vector)), dtype=np.float32), "results": []},
+    )
+    cached_vectors = cache["vectors"]
+    if len(cached_vectors):
+        (best,), (score,) = cosine_topk(vector, cached_vectors, 1)
+        cached_k, cached_results = cache["results"][best]
+        if score >= SEMANTIC_CACHE_THRESHOLD and cached_k >= k:
+            logger.info(f"Semantic cache hit for query (similarity {score:.3f}).")
+            return cached_results[:k]
+
+    results = vector_store.similarity_search_by_vector(
+        list(embedding),
+        k=k,
+        search_params=_search_params.get(vector_store.collection_name, SEARCH_PARAMS),
+    )
+
+    cache["vectors"] = np.vstack([cached_vectors, vector])[-SEMANTIC_CACHE_SIZE:]
+    cache["results"] = (cache["results"] + [(k, results)])[-SEMANTIC_CACHE_SIZE:]
+    return results
+
+
+async def _add_batch(vector_store, batch_doc, batch_ids, semaphore, upsert_lock):
+    """
+    Embed a single batch of documents and upsert it into the vector store.
+
+    Args:
+        vector_store: An instance of QdrantVectorStore.
+        batch_doc (list): A list of document objects belonging to the batch.
+        batch_ids (list): The IDs corresponding to each document in `batch_doc`.
+        semaphore (asyncio.Semaphore): Semaphore limiting the number of in-flight embedding requests.
+        upsert_lock (asyncio.Lock): Lock applying the upserts one at a time, since the local Qdrant
+            client is not safe to use from several threads.
+
+    Returns:
+        list: The IDs of the documents added to the vector store.
+    """
+    async with semaphore:
+        vectors = await vector_store.embeddings.aembed_documents(
+            [d.page_content for d in batch_doc]
+        )
+    points = [
+        PointStruct(
+            id=uid,
+            vector={vector_store.vector_name: vector},
+            payload={
+                vector_store.content_payload_key: d.page_content,
+                vector_store.metadata_payload_key: d.metadata,
+            },
+        )
+        for uid, d, vector in zip(batch_ids, batch_doc, vectors)
+    ]
+    async with upsert_lock:
+        await asyncio.to_thread(
+            vector_store.client.upsert,
+            collection_name=vector_store.collection_name,
+            points=points,
+        )
+    return batch_ids
+
+
+async def add_doc(vector_store, doc, ids, batch_size=BATCH_SIZE):
     """
     Add documents to the vector store with the given IDs.
 
+    Documents whose IDs are already stored in the collection are skipped. The remaining documents
+    are split into batches of `batch_size`, each sorted by content length to keep the embedding
+    requests evenly sized. The batches are embedded concurrently and upserted one at a time.
+
     Args:
-        vector_store: An instance of QdrantVectorStore or similar that supports adding documents.
+        vector_store: An instance of QdrantVectorStore.
         doc (list): A list of document objects to be added.
         ids (list): A list of unique IDs corresponding to each document in `doc`.
+        batch_size (int, optional): Number of documents per batch. Defaults to `BATCH_SIZE`.
 
     Returns:
         None
     """
     file_name = doc[0].metadata.get("filename")
-    try:
-        vector_store.add_documents(documents=doc, ids=ids)
+    existing = {
+        str(point.id)
+        for point in vector_store.client.retrieve(
+            collection_name=vector_store.collection_name,
+            ids=ids,
+            with_payload=False,
+            with_vectors=False,
+        )
+    }
+    if existing:
+        logger.info(f"Skipping {len(existing)} segments of {file_name} already in vector store")
+        pairs = [(uid, d) for uid, d in zip(ids, doc) if uid not in existing]
+        ids, doc = [uid for uid, _ in pairs], [d for _, d in pairs]
+    if not doc:
+        logger.success(f"Document {file_name} already in vector store")
+        return
+
+    batches = []
+    for i in range(0, len(doc), batch_size):
+        pairs = sorted(
+            zip(ids[i : i + batch_size], doc[i : i + batch_size]),
+            key=lambda pair: len(pair[1].page_content),
+        )
+        batches.append(([d for _, d in pairs], [uid for uid, _ in pairs]))
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_BATCHES)
+    upsert_lock = asyncio.Lock()
+    results = await asyncio.gather(
+        *(_add_batch(vector_store, d, i, semaphore, upsert_lock) for d, i in batches),
+        return_exceptions=True,
+    )
+    # cached search results may no longer be the closest documents of the collection
+    _semantic_cache.pop(vector_store.collection_name, None)
+
+    failed = 0
+    for batch_number, result in enumerate(results):
+        if not isinstance(result, BaseException):
+            continue
+        failed += 1
+        if isinstance(result, ValueError):
+            logger.error(
+                f"There's an error while handling the document list (batch {batch_number}): {result}"
+            )
+        elif isinstance(result, TypeError):
+            logger.error(f"Type error while handling document list (batch {batch_number}): {result}")
+        elif isinstance(result, ConnectionError):
+            logger.error(
+                f"Connection error while communicating with Vector Store (batch {batch_number}): {result}"
+            )
+        else:
+            logger.error(
+                f"Unexpected error occurred while adding document {file_name} (batch {batch_number}): {result}"
+            )
+
+    if not failed:
         logger.success(f"Document {file_name} added to vector store")
-    except ValueError as e:
-        logger.error(f"There's an error while handling the document list: {e}")
-    except TypeError as e:
-        logger.error(f"Type error while handling document list: {e}")
-    except ConnectionError as e:
-        logger.error(f"Connection error while communicating with Vector Store: {e}")
-    except Exception as e:
-        logger.error(f"Unexpected error ocurred whhile adding document {file_name}: {e}")
+    else:
+        logger.warning(f"Document {file_name} added with {failed}/{len(batches)} failed batches")
@@ -0,0 +1,64 @@
+"""
+This module provides concurrent retrieval over several document sources. It contains two primary
+functions:
+- `qdrant_source`: Wraps a vector store into a retrieval source.
+- `parallel_retrieve`: Queries every source concurrently and merges their results, so the total
+  retrieval latency is that of the slowest source rather than the sum of all of them.
+
+A source is any coroutine function taking a query and a number of results `k` and returning a
+list of Document objects, which makes it straightforward to add keyword or web search alongside
+the vector store.
+"""
+import asyncio
+from loguru import logger
+from preprocess_docs import similarity_search
+
+
+def qdrant_source(vector_store):
+    """
+    Build a retrieval source backed by a vector store.
+
+    Args:
+        vector_store: An instance of QdrantVectorStore.
+
+    Returns:
+        Callable: A coroutine function `(query, k) -> list` searching the vector store through
+        `preprocess_docs.similarity_search`, so it shares its query embedding and semantic caches.
+    """
+    async def search(query: str, k: int):
+        return await asyncio.to_thread(similarity_search, vector_store, query, k)
+
+    return search
+
+
+async def parallel_retrieve(query: str, sources: list, k: int = 3):
+    """
+    Retrieve documents for a query from several sources concurrently.
+
+    Args:
+        query (str): The query text.
+        sources (list): Coroutine functions `(query, k) -> list` returning document objects.
+        k (int, optional): Number of documents to request from each source. Defaults to 3.
+
+    Returns:
+        list: The retrieved document objects, in source order, without duplicated content.
+        Sources that fail are logged and skipped.
+    """
+    results = await asyncio.gather(
+        *(source(query, k) for source in sources), return_exceptions=True
+    )
+
+    seen = set()
+    docs = []
+    for source, result in zip(sources, results):
+        if isinstance(result, BaseException):
+            source_name = getattr(source, "__qualname__", source)
+            logger.error(f"Error while retrieving from {source_name}: {result}")
+            continue
+        for doc in result:
+            if doc.page_content in seen:
+                continue
+            seen.add(doc.page_content)
+            docs.append(doc)
+
+    return docs
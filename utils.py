@@ -2,13 +2,43 @@
 Functions used to visualize and process data before being handled by LLM models.
 """
 import os
+import sys
 import base64
-import io
+import functools
+import itertools
 import fitz
 import getpass
 from matplotlib import patches
+from matplotlib.collections import PolyCollection
 import matplotlib.pyplot as plt
 from PIL import Image
+import numpy as np
+
+try:
+    import simsimd
+except ImportError:  # simsimd is optional; fall back to NumPy
+    simsimd = None
+
+try:
+    import numba
+except ImportError:  # numba is optional; fall back to simsimd or NumPy
+    numba = None
+
+DEFAULT_DPI = 150
+
+
+@functools.lru_cache(maxsize=8)
+def _open_pdf(path: str):
+    """
+    Open a PDF document, reusing the parsed document across calls for the same path.
+
+    Args:
+        path (str): The file path of the PDF document.
+
+    Returns:
+        fitz.Document: The opened PDF document.
+    """
+    return fitz.open(path)
 
 
 def document_to_dict(doc):
@@ -24,17 +54,119 @@ def document_to_dict(doc):
     return {"page_content": doc.page_content, "metadata": doc.metadata}
 
 
-def plot_pdf_with_boxes(pdf_page, segments):
+if numba is not None:
+
+    @numba.njit(parallel=True, fastmath=True)
+    def _dot_scores(query, matrix):
+        scores = np.empty(matrix.shape[0], dtype=np.float32)
+        for i in numba.prange(matrix.shape[0]):
+            acc = 0.0
+            for j in range(matrix.shape[1]):
+                acc += matrix[i, j] * query[j]
+            scores[i] = acc
+        return scores
+
+
+def cosine_topk(query_vec, matrix, k: int):
+    """
+    Find the `k` rows of `matrix` most similar to `query_vec`.
+
+    Both the query and the rows of the matrix are expected to be L2-normalized, so cosine
+    similarity reduces to a dot product. The dot products are computed with a parallel
+    Numba-compiled kernel when `numba` is installed, with SIMD kernels via `simsimd` when it is
+    installed instead, and with NumPy otherwise.
+
+    Args:
+        query_vec (np.ndarray): A 1-D normalized query vector.
+        matrix (np.ndarray): A 2-D array of normalized vectors, one per row.
+        k (int): Number of results to return.
+
+    Returns:
+        tuple: The indices of the top-k rows and their scores, sorted by descending score.
+    """
+    query_vec = np.ascontiguousarray(query_vec, dtype=np.float32)
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    if numba is not None:
+        scores = _dot_scores(query_vec, matrix)
+    elif simsimd is not None:
+        # simsimd's "dot" metric returns the inner product itself
+        scores = np.asarray(simsimd.cdist(query_vec[None, :], matrix, metric="dot"))[0]
+    else:
+        scores = matrix @ query_vec
+
+    k = min(k, len(scores))
+    top = np.argpartition(scores, -k)[-k:]
+    top = top[np.argsort(scores[top])[::-1]]
+    return top, scores[top]
+
+
+def segments_to_soa(segments):
+    """
+    Convert a page's segments to a structure of arrays.
+
+    Args:
+        segments (list of dict): Segment metadata dictionaries of a single page, as described in
+            `plot_pdf_with_boxes`.
+
+    Returns:
+        dict: A dictionary with the following keys:
+            - "xs", "ys": Arrays of shape (N, V) holding the polygon vertices of the N segments.
+              Polygons with fewer than V vertices repeat their last vertex.
+            - "categories": Array of shape (N,) with the category of each segment.
+            - "layout_w", "layout_h": Layout dimensions the vertices are expressed in.
+    """
+    if not segments:
+        return {
+            "xs": np.empty((0, 0), dtype=np.float32),
+            "ys": np.empty((0, 0), dtype=np.float32),
+            "categories": np.empty(0, dtype=object),
+            "layout_w": 1.0,
+            "layout_h": 1.0,
+        }
+
+    layout_w = float(segments[0]["coordinates"]["layout_width"])
+    layout_h = float(segments[0]["coordinates"]["layout_height"])
+    n_vertices = max(len(segment["coordinates"]["points"]) for segment in segments)
+    points = np.empty((len(segments), n_vertices, 2), dtype=np.float32)
+    # segments of a page almost always share their layout dimensions, so the factors expressing
+    # every segment in the layout of the first one are computed once per distinct layout
+    layout_scales = {(layout_w, layout_h): None}
+    for i, segment in enumerate(segments):
+        coordinates = segment["coordinates"]
+        segment_points = np.asarray(coordinates["points"], dtype=np.float32)
+        layout = (coordinates["layout_width"], coordinates["layout_height"])
+        if layout not in layout_scales:
+            layout_scales[layout] = np.array(
+                [layout_w / layout[0], layout_h / layout[1]], dtype=np.float32
+            )
+        if layout_scales[layout] is not None:
+            segment_points = segment_points * layout_scales[layout]
+        points[i, : len(segment_points)] = segment_points
+        points[i, len(segment_points) :] = segment_points[-1]
+
+    return {
+        "xs": points[:, :, 0],
+        "ys": points[:, :, 1],
+        "categories": np.array([segment["category"] for segment in segments], dtype=object),
+        "layout_w": layout_w,
+        "layout_h": layout_h,
+    }
+
+
+def plot_pdf_with_boxes(pdf_page, segments, dpi: int = DEFAULT_DPI):
     """
     Plot a PDF page with overlaid bounding boxes for various content segments.
 
     Args:
         pdf_page: A PyMuPDF page object representing the PDF page to be plotted.
-        segments (list of dict): A list of dictionaries, where each dictionary represents a segment
-            with the following keys:
+        segments (list of dict or dict): A list of dictionaries, where each dictionary represents a
+            segment with the following keys:
             - "coordinates": A dictionary with keys "points", "layout_width", and "layout_height",
               representing the coordinates and dimensions of the bounding box.
             - "category": A string indicating the category of the segment (e.g., "Title", "Image", "Table").
+            The segments of a page may also be given as a structure of arrays, as returned by
+            `segments_to_soa` or `preprocess_docs.build_segment_soa`.
+        dpi (int, optional): Resolution used to render the page. Defaults to `DEFAULT_DPI`.
 
     The function will display the PDF page with bounding boxes drawn for each segment.
     Boxes are color-coded based on the segment's category, with the following default color assignments:
@@ -43,30 +175,24 @@ def plot_pdf_with_boxes(pdf_page, segments):
     - Table: Tomato
     - Text (default): Deepskyblue
     """
-    pix = pdf_page.get_pixmap()
+    pix = pdf_page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72))
     pil_image = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
 
     _, ax_ = plt.subplots(1, figsize=(10, 10))
     ax_.imshow(pil_image)
-    categories = set()
     category_to_color = {
         "Title": "orchid",
         "Image": "forestgreen",
         "Table": "tomato",
     }
-    for segment in segments:
-        points = segment["coordinates"]["points"]
-        scaled_points = [
-            (
-                x * pix.width / segment["coordinates"]["layout_width"],
-                y * pix.height / segment["coordinates"]["layout_height"],
-            )
-            for x, y in points
-        ]
-        box_color = category_to_color.get(segment["category"], "deepskyblue")
-        categories.add(segment["category"])
-        rect = patches.Polygon(scaled_points, linewidth=1, edgecolor=box_color, facecolor="none")
-        ax_.add_patch(rect)
+    soa = segments if isinstance(segments, dict) else segments_to_soa(segments)
+    scale = np.array([pix.width / soa["layout_w"], pix.height / soa["layout_h"]], dtype=np.float32)
+    scaled_points = np.stack([soa["xs"], soa["ys"]], axis=-1) * scale
+    categories = set(soa["categories"])
+    box_colors = [category_to_color.get(category, "deepskyblue") for category in soa["categories"]]
+    ax_.add_collection(
+        PolyCollection(scaled_points, linewidths=1, edgecolors=box_colors, facecolors="none")
+    )
 
     legend_handles = [patches.Patch(color="deepskyblue", label="Text")]
     for category in ["Title", "Image", "Table"]:
@@ -78,7 +204,34 @@ def plot_pdf_with_boxes(pdf_page, segments):
     plt.show()
 
 
-def render_page(file_path: str, doc_list: list, page_number: int, print_text=True) -> None:
+def build_page_index(doc_list: list) -> dict:
+    """
+    Group document objects by page number.
+
+    Args:
+        doc_list (list): A list of document objects, each containing 'page_content' and 'metadata'.
+
+    Returns:
+        dict: A dictionary mapping each page number to the list of documents on that page, in their
+        original order. Documents without a 'page_number' are grouped under page 0.
+    """
+    def page_of(doc):
+        return doc.metadata.get("page_number", 0)
+
+    return {
+        page: list(docs)
+        for page, docs in itertools.groupby(sorted(doc_list, key=page_of), key=page_of)
+    }
+
+
+def render_page(
+    file_path: str,
+    doc_list: list,
+    page_number: int,
+    print_text=True,
+    dpi: int = DEFAULT_DPI,
+    page_index: dict | None = None,
+) -> None:
     """
     Render a specific page of a PDF file with bounding boxes and optionally print text content.
 
@@ -88,6 +241,9 @@ def render_page(file_path: str, doc_list: list, page_number: int, print_text=Tru
                          The 'metadata' should include 'page_number' to match the document to a page.
         page_number (int): The page number to render (1-based index).
         print_text (bool, optional): Whether to print the text content of the segments on the page. Defaults to True.
+        dpi (int, optional): Resolution used to render the page. Defaults to `DEFAULT_DPI`.
+        page_index (dict, optional): A page index built with `build_page_index(doc_list)`. Pass it
+            when rendering several pages to avoid scanning `doc_list` on every call.
 
     Returns:
         None: This function displays the PDF page with overlaid bounding boxes and optionally prints text content.
@@ -96,55 +252,113 @@ def render_page(file_path: str, doc_list: list, page_number: int, print_text=Tru
     and uses `plot_pdf_with_boxes` to visualize the page with bounding boxes for each segment.
     If `print_text` is True, the text content of each segment is printed to the console.
     """
-    pdf_page = fitz.open(file_path).load_page(page_number - 1)
-    page_docs = [doc for doc in doc_list if doc.metadata.get("page_number") == page_number]
+    pdf_page = _open_pdf(file_path).load_page(page_number - 1)
+    if page_index is not None:
+        page_docs = page_index.get(page_number, [])
+    else:
+        page_docs = [doc for doc in doc_list if doc.metadata.get("page_number") == page_number]
     segments = [doc.metadata for doc in page_docs]
-    plot_pdf_with_boxes(pdf_page, segments)
+    plot_pdf_with_boxes(pdf_page, segments, dpi=dpi)
     if print_text:
         for doc in page_docs:
             print(f"{doc.page_content}\n")
 
 
-def pdf_page_to_base64(pdf_path: str, page_number: int):
+def pdf_page_to_base64(
+    pdf_path: str,
+    page_number: int,
+    dpi: int = DEFAULT_DPI,
+    image_format: str = "png",
+    jpg_quality: int = 85,
+):
     """
-    Convert a specific page of a PDF to a base64-encoded PNG image.
+    Convert a specific page of a PDF to a base64-encoded image.
 
     Args:
         pdf_path (str): The file path of the PDF document.
         page_number (int): The page number to convert (1-based index).
+        dpi (int, optional): Resolution used to render the page. Defaults to `DEFAULT_DPI`.
+        image_format (str, optional): Either "png" or "jpeg". JPEG produces roughly half the payload,
+            which matters when the image is sent to a vision model. Defaults to "png".
+        jpg_quality (int, optional): JPEG quality, used only when `image_format` is "jpeg".
+            Defaults to 85.
 
     Returns:
-        str: A base64-encoded string representing the PNG image of the specified page.
+        str: A base64-encoded string representing the image of the specified page.
 
-    The function loads the specified page from the PDF, converts it to an image, 
-    and returns a base64-encoded representation of the image in PNG format.
+    The function loads the specified page from the PDF, renders it to a pixmap and encodes it
+    directly with PyMuPDF, returning a base64-encoded representation of the image.
     """
-    pdf_document = fitz.open(pdf_path)
+    pdf_document = _open_pdf(pdf_path)
     page = pdf_document.load_page(page_number - 1)  # input is one-indexed
-    pix = page.get_pixmap()
-    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72))
+
+    if image_format == "jpeg":
+        image_bytes = pix.tobytes("jpeg", jpg_quality=jpg_quality)
+    elif image_format == "png":
+        image_bytes = pix.tobytes("png")
+    else:
+        raise ValueError(f"Unsupported image format: {image_format}")
+
+    return base64.b64encode(image_bytes).decode("ascii")
 
-    buffer = io.BytesIO()
-    img.save(buffer, format="PNG")
+KEY_PROMPTS = {
+    "UNSTRUCTURED_API_KEY": "Enter you Unstructured API key:",
+    "OPENAI_API_KEY": "Enter your OpenAI API key:",
+    "JINA_API_KEY": "Enter your Jina API key:",
+}
 
-    return base64.b64encode(buffer.getvalue()).decode("utf-8")
 
-def check_keys():
+def _can_prompt():
+    """
+    Check whether `getpass` can ask the user for input.
+
+    Returns:
+        bool: True in an interactive terminal or under IPython/Jupyter, whose frontend handles the
+        prompt even though stdin is not a TTY.
+    """
+    if sys.stdin is not None and sys.stdin.isatty():
+        return True
+    ipython = sys.modules.get("IPython")
+    return ipython is not None and ipython.get_ipython() is not None
+
+
+def check_keys(partition_via_api: bool = True, embeddings_backend: str | None = None):
     """
     Check whether the required API keys are set as environment variables.
 
-    Prompts the user to enter the 'UNSTRUCTURED_API_KEY' and 'OPENAI_API_KEY' if they are not set in
-    the environment variables.
+    The 'OPENAI_API_KEY' is always required, the 'UNSTRUCTURED_API_KEY' only when documents are
+    partitioned with the Unstructured API and the 'JINA_API_KEY' only when embedding through the
+    Jina API. Missing keys are prompted for; when prompting is not possible (no terminal and not
+    under IPython), a RuntimeError is raised instead of waiting for input. Keys already checked
+    are not checked again.
+
+    Args:
+        partition_via_api (bool, optional): Whether documents are partitioned with the Unstructured
+            API. Defaults to True.
+        embeddings_backend (str, optional): The embeddings backend in use. Defaults to the
+            `RAG_EMBEDDINGS_BACKEND` environment variable, or "jina" when it is not set.
 
     Returns:
         None: This function does not return a value.
     """
-    if "UNSTRUCTURED_API_KEY" not in os.environ:
-        os.environ["UNSTRUCTURED_API_KEY"] = getpass.getpass(
-            "Enter you Unstructured API key:"
-        )
-    if "OPENAI_API_KEY" not in os.environ:
-        os.environ["OPENAI_API_KEY"] = getpass.getpass(
-            "Enter your OpenAI API key:"
-        )
+    if embeddings_backend is None:
+        embeddings_backend = os.environ.get("RAG_EMBEDDINGS_BACKEND", "jina")
+    required = {"OPENAI_API_KEY"}
+    if partition_via_api:
+        required.add("UNSTRUCTURED_API_KEY")
+    if embeddings_backend == "jina":
+        required.add("JINA_API_KEY")
+
+    checked = getattr(check_keys, "_checked", set())
+    if required <= checked:
+        return None
+
+    missing = [key for key in KEY_PROMPTS if key in required and key not in os.environ]
+    if missing and not _can_prompt():
+        raise RuntimeError(f"Missing required environment variables: {', '.join(missing)}")
+    for key in missing:
+        os.environ[key] = getpass.getpass(KEY_PROMPTS[key])
+
+    check_keys._checked = checked | required
     return None